@@ -5,11 +5,17 @@ Optimized for Railway deployment
 """
 
 import os
+import re
+import sys
 import json
+import time
 import sqlite3
 import logging
+import asyncio
+import threading
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -27,6 +33,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# orjson parses Bot API responses several times faster than stdlib json;
+# fall back silently when it isn't installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class ORJSONRequest(HTTPXRequest):
+    """HTTPXRequest that decodes Bot API payloads with orjson."""
+
+    def parse_json_payload(self, payload: bytes):
+        return orjson.loads(payload)
+
+_REQUEST_CLS = ORJSONRequest if orjson is not None else HTTPXRequest
+
 # ── Config: Railway uses Environment Variables (no config.json needed) ─────────
 def load_config():
     """
@@ -37,7 +58,7 @@ def load_config():
     bot_token = os.environ.get("BOT_TOKEN")
     if bot_token:
         admin_ids_raw = os.environ.get("ADMIN_IDS", "")
-        admin_ids = [int(x.strip()) for x in admin_ids_raw.split(",") if x.strip().isdigit()]
+        admin_ids = list(map(int, re.findall(r'\d+', admin_ids_raw)))
         return {
             "bot_token": bot_token,
             "admin_ids": admin_ids,
@@ -105,6 +126,7 @@ TRANSLATIONS = {
         'duration_title': '📱 <b>{plan_name} Plan</b>\nDevices: {devices}\n\n⏱ <b>Choose duration:</b>\n\n',
         'duration_item': '• <b>{label}</b>: ${price} (${monthly}/month)\n',
         'payment_title': '💳 <b>Payment</b>\n\n📱 Plan: {plan}\n⏱ Duration: {duration} days\n💰 Total: <b>${price}</b>\n\n🔒 Secure payment\nChoose payment method:',
+        'payment_processing': '⏳ Processing your payment...',
         'payment_success': '✅ <b>Payment Successful!</b>\n\n📱 Plan: {plan}\n⏱ Duration: {duration} days\n💰 Paid: ${price}\n✅ Expires: <code>{expires}</code>\n\n📱 <b>Your VPN Configuration:</b>\n<code>{config}</code>\n\n🎁 Invite friends and earn rewards!',
         'account_title': '👤 <b>Your Account</b>\n\n🆔 ID: <code>{user_id}</code>\n👤 Name: {name}\n📅 Member since: {date}\n\n📊 <b>Subscription:</b> {status}\n💰 <b>Total spent:</b> ${spent}\n👥 <b>Referrals:</b> {refs}',
         'status_no_sub': '❌ No active subscription',
@@ -139,6 +161,7 @@ TRANSLATIONS = {
         'duration_title': '📱 <b>План {plan_name}</b>\nУстройств: {devices}\n\n⏱ <b>Выберите длительность:</b>\n\n',
         'duration_item': '• <b>{label}</b>: ${price} (${monthly}/месяц)\n',
         'payment_title': '💳 <b>Оплата</b>\n\n📱 План: {plan}\n⏱ Длительность: {duration} дней\n💰 Итого: <b>${price}</b>\n\n🔒 Безопасная оплата\nВыберите способ оплаты:',
+        'payment_processing': '⏳ Обрабатываем ваш платёж...',
         'payment_success': '✅ <b>Оплата успешна!</b>\n\n📱 План: {plan}\n⏱ Длительность: {duration} дней\n💰 Оплачено: ${price}\n✅ Истекает: <code>{expires}</code>\n\n📱 <b>Ваша VPN конфигурация:</b>\n<code>{config}</code>\n\n🎁 Приглашайте друзей и получайте награды!',
         'account_title': '👤 <b>Ваш аккаунт</b>\n\n🆔 ID: <code>{user_id}</code>\n👤 Имя: {name}\n📅 С нами с: {date}\n\n📊 <b>Подписка:</b> {status}\n💰 <b>Всего потрачено:</b> ${spent}\n👥 <b>Рефералов:</b> {refs}',
         'status_no_sub': '❌ Нет активной подписки',
@@ -173,6 +196,7 @@ TRANSLATIONS = {
         'duration_title': '📱 <b>{plan_name} प्लान</b>\nडिवाइस: {devices}\n\n⏱ <b>अवधि चुनें:</b>\n\n',
         'duration_item': '• <b>{label}</b>: ${price} (${monthly}/महीना)\n',
         'payment_title': '💳 <b>पेमेंट</b>\n\n📱 प्लान: {plan}\n⏱ अवधि: {duration} दिन\n💰 कुल: <b>${price}</b>\n\n🔒 सुरक्षित पेमेंट\nपेमेंट तरीका चुनें:',
+        'payment_processing': '⏳ आपका पेमेंट प्रोसेस हो रहा है...',
         'payment_success': '✅ <b>पेमेंट सफल रहा!</b>\n\n📱 प्लान: {plan}\n⏱ अवधि: {duration} दिन\n💰 भुगतान: ${price}\n✅ समाप्त होगा: <code>{expires}</code>\n\n📱 <b>आपका VPN कॉन्फिगरेशन:</b>\n<code>{config}</code>\n\n🎁 दोस्तों को इनवाइट करें और रिवॉर्ड पाएं!',
         'account_title': '👤 <b>आपका अकाउंट</b>\n\n🆔 ID: <code>{user_id}</code>\n👤 नाम: {name}\n📅 मेंबर बने: {date}\n\n📊 <b>सब्सक्रिप्शन:</b> {status}\n💰 <b>कुल खर्च:</b> ${spent}\n👥 <b>रेफरल:</b> {refs}',
         'status_no_sub': '❌ कोई सक्रिय सब्सक्रिप्शन नहीं',
@@ -207,6 +231,7 @@ TRANSLATIONS = {
         'duration_title': '📱 <b>خطة {plan_name}</b>\nالأجهزة: {devices}\n\n⏱ <b>اختر المدة:</b>\n\n',
         'duration_item': '• <b>{label}</b>: ${price} (${monthly}/شهر)\n',
         'payment_title': '💳 <b>الدفع</b>\n\n📱 الخطة: {plan}\n⏱ المدة: {duration} يوم\n💰 المجموع: <b>${price}</b>\n\n🔒 دفع آمن\nاختر طريقة الدفع:',
+        'payment_processing': '⏳ جارٍ معالجة دفعتك...',
         'payment_success': '✅ <b>تم الدفع بنجاح!</b>\n\n📱 الخطة: {plan}\n⏱ المدة: {duration} يوم\n💰 المدفوع: ${price}\n✅ تنتهي في: <code>{expires}</code>\n\n📱 <b>إعدادات VPN الخاصة بك:</b>\n<code>{config}</code>\n\n🎁 ادعُ الأصدقاء واربح مكافآت!',
         'account_title': '👤 <b>حسابك</b>\n\n🆔 المعرف: <code>{user_id}</code>\n👤 الاسم: {name}\n📅 عضو منذ: {date}\n\n📊 <b>الاشتراك:</b> {status}\n💰 <b>إجمالي الإنفاق:</b> ${spent}\n👥 <b>الإحالات:</b> {refs}',
         'status_no_sub': '❌ لا يوجد اشتراك نشط',
@@ -215,101 +240,275 @@ TRANSLATIONS = {
     }
 }
 
+# Flat (lang, key) → text table with the English fallback baked in at import,
+# so each t() call is one dict lookup instead of a three-step .get() chain.
+# Keys are interned: call sites use string literals (already interned by
+# CPython), so tuple hashing hits the identity fast path.
+_T = {}
+for _lang, _texts in TRANSLATIONS.items():
+    for _key in TRANSLATIONS['en']:
+        _T[(sys.intern(_lang), sys.intern(_key))] = _texts.get(_key, TRANSLATIONS['en'][_key])
+
 # ── Database ───────────────────────────────────────────────────────────────────
+# Store/load datetimes through the driver so TIMESTAMP columns come back as
+# real datetime objects — no per-read isinstance/fromisoformat dance.
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(sep=" "))
+sqlite3.register_converter("TIMESTAMP", lambda b: datetime.fromisoformat(b.decode()))
+
+# UPDATE ... RETURNING needs SQLite 3.35+
+_SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Whole schema in one script; PRAGMA user_version marks it applied so restarts
+# (frequent on Railway) skip the DDL entirely.
+_SCHEMA_VERSION = 3
+_DDL = '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        language_code TEXT DEFAULT 'en',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        referrer_id INTEGER,
+        subscription_end TIMESTAMP,
+        is_trial_used BOOLEAN DEFAULT 0,
+        is_blocked BOOLEAN DEFAULT 0,
+        total_paid REAL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS subscriptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        plan_name TEXT,
+        devices INTEGER,
+        duration_days INTEGER,
+        price REAL DEFAULT 0,
+        currency TEXT DEFAULT 'USD',
+        payment_method TEXT,
+        started_at TIMESTAMP,
+        expires_at TIMESTAMP,
+        config_url TEXT,
+        is_active BOOLEAN DEFAULT 1,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    );
+    CREATE TABLE IF NOT EXISTS payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        amount REAL,
+        currency TEXT DEFAULT 'USD',
+        payment_method TEXT,
+        payment_id TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_users_referrer ON users(referrer_id);
+    CREATE INDEX IF NOT EXISTS idx_subs_user_active ON subscriptions(user_id, is_active);
+    CREATE INDEX IF NOT EXISTS idx_users_sub_end ON users(subscription_end);
+    CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id);
+    PRAGMA user_version = {version};
+'''.format(version=_SCHEMA_VERSION)
+
 class Database:
+    """One long-lived connection in WAL mode — per-call connect/close was the
+    main latency source on hot callback paths."""
+
+    _USER_CACHE_MAX = 10000
+
     def __init__(self):
+        self._conn = sqlite3.connect(
+            DB_PATH, check_same_thread=False, isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=256
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # Write-through cache: one menu render calls get_user 8-15 times with
+        # the same id, so serve repeats from memory and invalidate on writes.
+        self._user_cache = {}
         self.init_db()
 
     def init_db(self):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                language_code TEXT DEFAULT 'en',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                referrer_id INTEGER,
-                subscription_end TIMESTAMP,
-                is_trial_used BOOLEAN DEFAULT 0,
-                is_blocked BOOLEAN DEFAULT 0,
-                total_paid REAL DEFAULT 0
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                plan_name TEXT,
-                devices INTEGER,
-                duration_days INTEGER,
-                price REAL DEFAULT 0,
-                currency TEXT DEFAULT 'USD',
-                payment_method TEXT,
-                started_at TIMESTAMP,
-                expires_at TIMESTAMP,
-                config_url TEXT,
-                is_active BOOLEAN DEFAULT 1,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount REAL,
-                currency TEXT DEFAULT 'USD',
-                payment_method TEXT,
-                payment_id TEXT,
-                status TEXT DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        cursor = self._conn.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA mmap_size=268435456')   # 256 MB
+        cursor.execute('PRAGMA cache_size=-65536')     # 64 MB page cache
+        cursor.execute('PRAGMA busy_timeout=5000')
+        if cursor.execute('PRAGMA user_version').fetchone()[0] >= _SCHEMA_VERSION:
+            return
+        self._conn.executescript(_DDL)
 
     def get_user(self, user_id):
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
-        return dict(user) if user else None
+        cached = self._user_cache.get(user_id)
+        if cached is not None:
+            return cached
+        with self._lock:
+            user = self._conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        if user is None:
+            return None
+        if len(self._user_cache) >= self._USER_CACHE_MAX:
+            self._user_cache.pop(next(iter(self._user_cache)))
+        user = dict(user)
+        self._user_cache[user_id] = user
+        return user
 
     def create_user(self, user_id, username, first_name, language='en', referrer_id=None):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, username, first_name, language_code, referrer_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, language, referrer_id))
-        conn.commit()
-        conn.close()
+        with self._lock:
+            self._conn.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, language_code, referrer_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, username, first_name, language, referrer_id))
+        self._user_cache.pop(user_id, None)
 
     def set_language(self, user_id, language):
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET language_code = ? WHERE user_id = ?', (language, user_id))
-        conn.commit()
-        conn.close()
+        with self._lock:
+            self._conn.execute('UPDATE users SET language_code = ? WHERE user_id = ?', (language, user_id))
+        self._user_cache.pop(user_id, None)
 
     def get_language(self, user_id):
         user = self.get_user(user_id)
         return user['language_code'] if user else 'en'
 
+    def expiring_before(self, ts):
+        """User ids whose subscription ends before ts — indexed, for
+        cron-style expiry sweeps instead of a full-table scan in Python."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT user_id FROM users WHERE subscription_end < ? AND subscription_end IS NOT NULL',
+                (ts,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def activate_trial(self, user_id, expires_at):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE users SET subscription_end = ?, is_trial_used = 1 WHERE user_id = ?',
+                (expires_at, user_id)
+            )
+        self._user_cache.pop(user_id, None)
+
+    def record_payment(self, user_id, plan_name, devices, duration_days, price, payment_method, config_url):
+        """Extend the subscription and log it in one BEGIN IMMEDIATE transaction.
+        Returns the new expiry datetime."""
+        current_time = datetime.now()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if _SQLITE_HAS_RETURNING:
+                    row = self._conn.execute('''
+                        UPDATE users
+                        SET subscription_end = datetime(MAX(COALESCE(subscription_end, ?), ?), ?),
+                            total_paid = total_paid + ?
+                        WHERE user_id = ?
+                        RETURNING subscription_end
+                    ''', (current_time, current_time, f'+{duration_days} days', price, user_id)).fetchone()
+                    new_end = row['subscription_end']
+                else:
+                    row = self._conn.execute(
+                        'SELECT subscription_end FROM users WHERE user_id = ?', (user_id,)
+                    ).fetchone()
+                    current_end = row['subscription_end'] if row and row['subscription_end'] else current_time
+                    if current_end < current_time:
+                        current_end = current_time
+                    new_end = current_end + timedelta(days=duration_days)
+                    self._conn.execute(
+                        'UPDATE users SET subscription_end = ?, total_paid = total_paid + ? WHERE user_id = ?',
+                        (new_end, price, user_id)
+                    )
+                self._conn.execute('''
+                    INSERT INTO subscriptions
+                    (user_id, plan_name, devices, duration_days, price, payment_method, started_at, expires_at, config_url)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, plan_name, devices, duration_days, price, payment_method, current_time, new_end, config_url))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        self._user_cache.pop(user_id, None)
+        return new_end
+
+    def record_star_payment(self, user_id, plan_name, devices, duration_days, price,
+                            currency, payment_id, config_url):
+        """Like record_payment, but also logs the Telegram Stars charge in the
+        payments table — all inside the same transaction."""
+        current_time = datetime.now()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if _SQLITE_HAS_RETURNING:
+                    row = self._conn.execute('''
+                        UPDATE users
+                        SET subscription_end = datetime(MAX(COALESCE(subscription_end, ?), ?), ?),
+                            total_paid = total_paid + ?
+                        WHERE user_id = ?
+                        RETURNING subscription_end
+                    ''', (current_time, current_time, f'+{duration_days} days', price, user_id)).fetchone()
+                    new_end = row['subscription_end']
+                else:
+                    row = self._conn.execute(
+                        'SELECT subscription_end FROM users WHERE user_id = ?', (user_id,)
+                    ).fetchone()
+                    current_end = row['subscription_end'] if row and row['subscription_end'] else current_time
+                    if current_end < current_time:
+                        current_end = current_time
+                    new_end = current_end + timedelta(days=duration_days)
+                    self._conn.execute(
+                        'UPDATE users SET subscription_end = ?, total_paid = total_paid + ? WHERE user_id = ?',
+                        (new_end, price, user_id)
+                    )
+                self._conn.execute('''
+                    INSERT INTO subscriptions
+                    (user_id, plan_name, devices, duration_days, price, payment_method, started_at, expires_at, config_url)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, plan_name, devices, duration_days, price, 'telegram_stars',
+                      current_time, new_end, config_url))
+                self._conn.execute('''
+                    INSERT INTO payments (user_id, amount, currency, payment_method, payment_id, status)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (user_id, price, currency, 'telegram_stars', payment_id, 'completed'))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        self._user_cache.pop(user_id, None)
+        return new_end
+
 db = Database()
 
 # ── Helpers ────────────────────────────────────────────────────────────────────
-def t(user_id, key, **kwargs):
-    lang = db.get_language(user_id)
-    text = TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, TRANSLATIONS['en'].get(key, key))
+def t(user_id, key, lang=None, **kwargs):
+    if lang is None:
+        lang = db.get_language(user_id)
+    text = _T.get((lang, key)) or _T.get(('en', key), key)
+    if kwargs:
+        return text.format(**kwargs)
+    return text
+
+def t_lang(lang, key, **kwargs):
+    """Like t() but with the language already resolved — no DB/cache traffic."""
+    text = _T.get((lang, key)) or _T.get(('en', key), key)
     if kwargs:
         return text.format(**kwargs)
     return text
 
+def _resolve_lang(user_id, context):
+    """Resolve the user's language once per update and pin it on user_data."""
+    lang = context.user_data.get('lang')
+    if lang not in TRANSLATIONS:
+        lang = db.get_language(user_id)
+        if lang not in TRANSLATIONS:
+            lang = 'en'
+        context.user_data['lang'] = lang
+    return lang
+
+# Bound .format methods for the demo config URLs — the host part is constant,
+# only the user id varies per activation.
+_VLESS_TRIAL = "vless://trial-{uid}@demo.server:443".format
+_VLESS_SUB   = "vless://sub-{uid}@demo.server:443".format
+_VLESS_PAID  = "vless://paid-{uid}@demo.server:443".format
+
+# Invoice payloads look like "plan_0_dur_30" (see process_payment).
+_PAYLOAD_RE = re.compile(r'^plan_(\d+)_dur_(\d+)$')
+
 def get_language_keyboard():
     keyboard = []
     for lang_code, lang_data in TRANSLATIONS.items():
@@ -323,11 +522,169 @@ def get_language_keyboard():
 PLANS = {
     "durations": [30, 60, 180, 365],
     "plans": [
-        {"name": "Basic",    "devices": 1, "prices": {"30": 5,  "60": 9,  "180": 25, "365": 45}},
-        {"name": "Standard", "devices": 3, "prices": {"30": 10, "60": 18, "180": 50, "365": 90}},
-        {"name": "Premium",  "devices": 5, "prices": {"30": 15, "60": 27, "180": 75, "365": 135}},
+        {"name": "Basic",    "devices": 1, "prices": {30: 5,  60: 9,  180: 25, 365: 45}},
+        {"name": "Standard", "devices": 3, "prices": {30: 10, 60: 18, 180: 50, 365: 90}},
+        {"name": "Premium",  "devices": 5, "prices": {30: 15, 60: 27, 180: 75, 365: 135}},
     ]
 }
+# Tuple view for hot-path indexing — skips the outer dict hop per callback.
+_PLAN_LIST = tuple(PLANS['plans'])
+
+# ── Prebuilt keyboards ─────────────────────────────────────────────────────────
+# Button text only depends on (lang, trial_used, is_admin), so build every
+# variant once at import instead of allocating the same widget tree per tap.
+LANG_KEYBOARD = get_language_keyboard()
+
+def _build_main_menu(lang, trial_used, is_admin):
+    tr = TRANSLATIONS[lang]
+    if not trial_used:
+        keyboard = [
+            [InlineKeyboardButton(tr['btn_trial'],    callback_data="trial")],
+            [InlineKeyboardButton(tr['btn_buy'],      callback_data="plans")],
+            [InlineKeyboardButton(tr['btn_about'],    callback_data="about"),
+             InlineKeyboardButton(tr['btn_support'],  callback_data="support")],
+            [InlineKeyboardButton(tr['btn_language'], callback_data="change_lang")],
+        ]
+    else:
+        keyboard = [
+            [InlineKeyboardButton(tr['btn_buy'],      callback_data="plans")],
+            [InlineKeyboardButton(tr['btn_account'],  callback_data="account")],
+            [InlineKeyboardButton(tr['btn_referral'], callback_data="referrals"),
+             InlineKeyboardButton(tr['btn_promo'],    callback_data="promocode")],
+            [InlineKeyboardButton(tr['btn_help'],     callback_data="help"),
+             InlineKeyboardButton(tr['btn_support'],  callback_data="support")],
+            [InlineKeyboardButton(tr['btn_language'], callback_data="change_lang")],
+        ]
+    if is_admin:
+        keyboard.append([InlineKeyboardButton(tr['btn_admin'], callback_data="admin")])
+    return InlineKeyboardMarkup(keyboard)
+
+def _build_plans_keyboard(lang):
+    keyboard = []
+    for i, plan in enumerate(PLANS['plans']):
+        keyboard.append([InlineKeyboardButton(
+            f"📱 {plan['name']} ({plan['devices']} device{'s' if plan['devices']>1 else ''})",
+            callback_data=f"plan_{i}"
+        )])
+    keyboard.append([InlineKeyboardButton(TRANSLATIONS[lang]['btn_back'], callback_data="back_main")])
+    return InlineKeyboardMarkup(keyboard)
+
+def _build_duration_keyboard(lang, plan_index):
+    plan = PLANS['plans'][plan_index]
+    keyboard = []
+    for duration in PLANS['durations']:
+        price = plan['prices'][duration]
+        label = f"{duration} days" if duration < 365 else "1 year"
+        keyboard.append([InlineKeyboardButton(
+            f"⏱ {label} - ${price}",
+            callback_data=f"dur_{plan_index}_{duration}"
+        )])
+    keyboard.append([InlineKeyboardButton(TRANSLATIONS[lang]['btn_back'], callback_data="plans")])
+    return InlineKeyboardMarkup(keyboard)
+
+MAIN_MENU_CACHE = {
+    (lang, trial, admin): _build_main_menu(lang, trial, admin)
+    for lang in TRANSLATIONS
+    for trial in (0, 1)
+    for admin in (False, True)
+}
+def _build_trial_keyboard(lang):
+    tr = TRANSLATIONS[lang]
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(tr['btn_buy'],  callback_data="plans")],
+        [InlineKeyboardButton(tr['btn_back'], callback_data="back_main")],
+    ])
+
+def _build_post_pay_keyboard(lang):
+    tr = TRANSLATIONS[lang]
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(tr['btn_account'],  callback_data="account")],
+        [InlineKeyboardButton(tr['btn_buy'],      callback_data="plans")],
+        [InlineKeyboardButton(tr['btn_referral'], callback_data="referrals")],
+    ])
+
+def _build_post_star_keyboard(lang):
+    tr = TRANSLATIONS[lang]
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(tr['btn_account'], callback_data="account")],
+        [InlineKeyboardButton(tr['btn_buy'],     callback_data="plans")],
+    ])
+
+PLANS_KEYBOARD_CACHE = {lang: _build_plans_keyboard(lang) for lang in TRANSLATIONS}
+TRIAL_KEYBOARD_CACHE = {lang: _build_trial_keyboard(lang) for lang in TRANSLATIONS}
+POST_PAY_KEYBOARD_CACHE = {lang: _build_post_pay_keyboard(lang) for lang in TRANSLATIONS}
+POST_STAR_KEYBOARD_CACHE = {lang: _build_post_star_keyboard(lang) for lang in TRANSLATIONS}
+DURATION_KEYBOARD_CACHE = {
+    (lang, i): _build_duration_keyboard(lang, i)
+    for lang in TRANSLATIONS
+    for i in range(len(PLANS['plans']))
+}
+
+# PLANS never changes at runtime, so the per-plan and per-duration message
+# fragments (price math, monthly rate formatting) are rendered once here and
+# the handlers just concatenate cached strings.
+def _build_plans_body(lang):
+    plan_item = _T[(lang, 'plan_item')]
+    body = ''
+    for plan in PLANS['plans']:
+        plural = 's' if plan['devices'] > 1 else ''
+        body += plan_item.format(name=plan['name'], devices=plan['devices'],
+                                 plural=plural, price=plan['prices'][30])
+    return body
+
+def _build_duration_body(lang, plan_index):
+    plan = PLANS['plans'][plan_index]
+    duration_item = _T[(lang, 'duration_item')]
+    body = ''
+    for duration in PLANS['durations']:
+        price = plan['prices'][duration]
+        label = f"{duration} days" if duration < 365 else "1 year"
+        monthly = price / (duration / 30)
+        body += duration_item.format(label=label, price=price, monthly=f"{monthly:.2f}")
+    return body
+
+PLANS_BODY_CACHE = {lang: _build_plans_body(lang) for lang in TRANSLATIONS}
+DURATION_BODY_CACHE = {
+    (lang, i): _build_duration_body(lang, i)
+    for lang in TRANSLATIONS
+    for i in range(len(PLANS['plans']))
+}
+
+# The payment screen only depends on (lang, plan, duration) — 48 combinations —
+# so text and keyboard are both rendered once here.
+def _build_payment_screen(lang, plan_index, duration):
+    plan = PLANS['plans'][plan_index]
+    price = plan['prices'][duration]
+    text = _T[(lang, 'payment_title')].format(
+        plan=f"{plan['name']} ({plan['devices']} devices)",
+        duration=duration, price=price
+    )
+    markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton("⭐ Telegram Stars",      callback_data=f"pay_stars_{plan_index}_{duration}")],
+        [InlineKeyboardButton("💳 Credit Card (Demo)",  callback_data=f"pay_card_{plan_index}_{duration}")],
+        [InlineKeyboardButton("🪙 Crypto (Demo)",       callback_data=f"pay_crypto_{plan_index}_{duration}")],
+        [InlineKeyboardButton(TRANSLATIONS[lang]['btn_back'], callback_data=f"plan_{plan_index}")],
+    ])
+    return text, markup
+
+PAYMENT_SCREENS = {
+    (lang, i, duration): _build_payment_screen(lang, i, duration)
+    for lang in TRANSLATIONS
+    for i in range(len(PLANS['plans']))
+    for duration in PLANS['durations']
+}
+
+# PTB passes a str reply_markup to the wire verbatim, so serialize every
+# static markup once here and skip the per-call to_dict/json.dumps pipeline
+# inside the request layer.
+LANG_KEYBOARD = LANG_KEYBOARD.to_json()
+MAIN_MENU_CACHE = {key: markup.to_json() for key, markup in MAIN_MENU_CACHE.items()}
+PLANS_KEYBOARD_CACHE = {key: markup.to_json() for key, markup in PLANS_KEYBOARD_CACHE.items()}
+TRIAL_KEYBOARD_CACHE = {key: markup.to_json() for key, markup in TRIAL_KEYBOARD_CACHE.items()}
+POST_PAY_KEYBOARD_CACHE = {key: markup.to_json() for key, markup in POST_PAY_KEYBOARD_CACHE.items()}
+POST_STAR_KEYBOARD_CACHE = {key: markup.to_json() for key, markup in POST_STAR_KEYBOARD_CACHE.items()}
+DURATION_KEYBOARD_CACHE = {key: markup.to_json() for key, markup in DURATION_KEYBOARD_CACHE.items()}
+PAYMENT_SCREENS = {key: (text, markup.to_json()) for key, (text, markup) in PAYMENT_SCREENS.items()}
 
 # ── Handlers ───────────────────────────────────────────────────────────────────
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -353,48 +710,54 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         if referrer_id:
             context.user_data['referrer_id'] = referrer_id
-        await update.message.reply_text(message, reply_markup=get_language_keyboard(), parse_mode='HTML')
+        await update.message.reply_text(message, reply_markup=LANG_KEYBOARD, parse_mode='HTML')
         return
 
-    status = get_subscription_status(user.id)
-    message = t(user.id, 'welcome_back', name=user.first_name, status=status)
-    await update.message.reply_text(message, reply_markup=get_main_menu(user.id), parse_mode='HTML')
+    lang = _resolve_lang(user.id, context)
+    status = get_subscription_status(user.id, lang)
+    message = t_lang(lang, 'welcome_back', name=user.first_name, status=status)
+    await update.message.reply_text(message, reply_markup=get_main_menu(user.id, lang), parse_mode='HTML')
 
-def get_main_menu(user_id):
+def get_main_menu(user_id, lang=None):
     user = db.get_user(user_id)
-    if not user or user['is_trial_used'] == 0:
-        keyboard = [
-            [InlineKeyboardButton(t(user_id, 'btn_trial'),    callback_data="trial")],
-            [InlineKeyboardButton(t(user_id, 'btn_buy'),      callback_data="plans")],
-            [InlineKeyboardButton(t(user_id, 'btn_about'),    callback_data="about"),
-             InlineKeyboardButton(t(user_id, 'btn_support'),  callback_data="support")],
-            [InlineKeyboardButton(t(user_id, 'btn_language'), callback_data="change_lang")],
-        ]
-    else:
-        keyboard = [
-            [InlineKeyboardButton(t(user_id, 'btn_buy'),      callback_data="plans")],
-            [InlineKeyboardButton(t(user_id, 'btn_account'),  callback_data="account")],
-            [InlineKeyboardButton(t(user_id, 'btn_referral'), callback_data="referrals"),
-             InlineKeyboardButton(t(user_id, 'btn_promo'),    callback_data="promocode")],
-            [InlineKeyboardButton(t(user_id, 'btn_help'),     callback_data="help"),
-             InlineKeyboardButton(t(user_id, 'btn_support'),  callback_data="support")],
-            [InlineKeyboardButton(t(user_id, 'btn_language'), callback_data="change_lang")],
-        ]
-    if user_id in ADMIN_IDS:
-        keyboard.append([InlineKeyboardButton(t(user_id, 'btn_admin'), callback_data="admin")])
-    return InlineKeyboardMarkup(keyboard)
-
-def get_subscription_status(user_id):
+    if lang is None:
+        lang = user['language_code'] if user else 'en'
+    if lang not in TRANSLATIONS:
+        lang = 'en'
+    trial_used = 1 if user and user['is_trial_used'] else 0
+    return MAIN_MENU_CACHE[(lang, trial_used, user_id in ADMIN_IDS)]
+
+# Menu navigation re-renders the subscription status far more often than it
+# changes (only on trial/payment), so cache the rendered text briefly. The
+# write paths pop the entry so a fresh purchase shows up immediately.
+_STATUS_CACHE = {}
+_STATUS_CACHE_MAX = 50000
+_STATUS_TTL = 30.0  # seconds
+
+def get_subscription_status(user_id, lang=None):
+    if lang is None:
+        user = db.get_user(user_id)
+        lang = user['language_code'] if user else 'en'
+    now = time.monotonic()
+    cached = _STATUS_CACHE.get(user_id)
+    if cached is not None and cached[1] == lang and cached[2] > now:
+        return cached[0]
+    status = _query_status(user_id, lang)
+    if len(_STATUS_CACHE) >= _STATUS_CACHE_MAX:
+        _STATUS_CACHE.pop(next(iter(_STATUS_CACHE)))
+    _STATUS_CACHE[user_id] = (status, lang, now + _STATUS_TTL)
+    return status
+
+def _query_status(user_id, lang):
     user = db.get_user(user_id)
     if not user or not user['subscription_end']:
-        return t(user_id, 'status_no_sub')
+        return t_lang(lang, 'status_no_sub')
     sub_end = user['subscription_end']
-    if isinstance(sub_end, str):
-        sub_end = datetime.fromisoformat(sub_end)
-    if sub_end < datetime.now():
-        return t(user_id, 'status_expired')
-    days_left = (sub_end - datetime.now()).days
-    return t(user_id, 'status_active', days=days_left)
+    now = datetime.now()
+    if sub_end < now:
+        return t_lang(lang, 'status_expired')
+    days_left = (sub_end - now).days
+    return t_lang(lang, 'status_active', days=days_left)
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -402,128 +765,109 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
     user_id = query.from_user.id
 
-    if data.startswith("lang_"):
-        lang = data.split("_")[1]
-        existing_user = db.get_user(user_id)
-        if existing_user:
-            db.set_language(user_id, lang)
-            status = get_subscription_status(user_id)
-            message = t(user_id, 'welcome_back', name=query.from_user.first_name, status=status)
-            await query.edit_message_text(message, reply_markup=get_main_menu(user_id), parse_mode='HTML')
-        else:
-            referrer_id = context.user_data.get('referrer_id', None)
-            db.create_user(user_id, query.from_user.username, query.from_user.first_name, lang, referrer_id)
-            message = t(user_id, 'welcome', name=query.from_user.first_name)
-            message += t(user_id, 'welcome_referred') if referrer_id else t(user_id, 'welcome_trial')
-            message += t(user_id, 'choose_option')
-            await query.edit_message_text(message, reply_markup=get_main_menu(user_id), parse_mode='HTML')
-        return
+    # One partition, one dict hit — no startswith chain, no double split.
+    prefix, sep, rest = data.partition('_')
+    handler = PREFIX_DISPATCH.get(prefix + sep) if sep else None
+    if handler is None:
+        handler = STATIC_DISPATCH.get(data)
+        rest = ''
+    if handler is not None:
+        await handler(query, context, user_id, rest)
+
+async def _on_lang(query, context, user_id, rest):
+    lang = rest if rest in TRANSLATIONS else 'en'
+    context.user_data['lang'] = lang
+    existing_user = db.get_user(user_id)
+    if existing_user:
+        db.set_language(user_id, lang)
+        status = get_subscription_status(user_id, lang)
+        message = t_lang(lang, 'welcome_back', name=query.from_user.first_name, status=status)
+    else:
+        referrer_id = context.user_data.get('referrer_id', None)
+        db.create_user(user_id, query.from_user.username, query.from_user.first_name, lang, referrer_id)
+        message = t_lang(lang, 'welcome', name=query.from_user.first_name)
+        message += t_lang(lang, 'welcome_referred') if referrer_id else t_lang(lang, 'welcome_trial')
+        message += t_lang(lang, 'choose_option')
+    await query.edit_message_text(message, reply_markup=get_main_menu(user_id, lang), parse_mode='HTML')
+
+async def _on_change_lang(query, context, user_id, rest):
+    lang = _resolve_lang(user_id, context)
+    await query.edit_message_text(
+        t_lang(lang, 'btn_language') + "\n\nSelect your language:",
+        reply_markup=LANG_KEYBOARD, parse_mode='HTML'
+    )
 
-    if data == "change_lang":
-        await query.edit_message_text(
-            t(user_id, 'btn_language') + "\n\nSelect your language:",
-            reply_markup=get_language_keyboard(), parse_mode='HTML'
-        )
-        return
+async def _on_trial(query, context, user_id, rest):
+    await handle_trial(query, _resolve_lang(user_id, context))
+
+async def _on_plans(query, context, user_id, rest):
+    await show_plans(query, _resolve_lang(user_id, context))
+
+async def _on_plan(query, context, user_id, rest):
+    await show_durations(query, int(rest), _resolve_lang(user_id, context))
+
+async def _on_dur(query, context, user_id, rest):
+    plan_index, _, duration = rest.partition('_')
+    await show_payment_methods(query, int(plan_index), int(duration), _resolve_lang(user_id, context))
 
-    if data == "trial":
-        await handle_trial(query)
-    elif data == "plans":
-        await show_plans(query)
-    elif data.startswith("plan_"):
-        await show_durations(query, int(data.split("_")[1]))
-    elif data.startswith("dur_"):
-        _, plan_index, duration = data.split("_")
-        await show_payment_methods(query, int(plan_index), int(duration))
-    elif data.startswith("pay_"):
-        parts = data.split("_")
-        method, plan_index, duration = parts[1], int(parts[2]), int(parts[3])
-        await process_payment(query, user_id, method, plan_index, duration)
-    elif data == "back_main":
-        await back_to_main(query)
-
-async def handle_trial(query):
+async def _on_pay(query, context, user_id, rest):
+    method, plan_index, duration = rest.split('_')
+    await process_payment(query, user_id, method, int(plan_index), int(duration),
+                          _resolve_lang(user_id, context))
+
+async def _on_back_main(query, context, user_id, rest):
+    await back_to_main(query, _resolve_lang(user_id, context))
+
+PREFIX_DISPATCH = {
+    "lang_": _on_lang,
+    "plan_": _on_plan,
+    "dur_":  _on_dur,
+    "pay_":  _on_pay,
+}
+STATIC_DISPATCH = {
+    "change_lang": _on_change_lang,
+    "trial":       _on_trial,
+    "plans":       _on_plans,
+    "back_main":   _on_back_main,
+}
+
+async def handle_trial(query, lang):
     user_id = query.from_user.id
     user = db.get_user(user_id)
     if user['is_trial_used']:
-        message = t(user_id, 'trial_used')
-        keyboard = [
-            [InlineKeyboardButton(t(user_id, 'btn_buy'),  callback_data="plans")],
-            [InlineKeyboardButton(t(user_id, 'btn_back'), callback_data="back_main")],
-        ]
+        message = t_lang(lang, 'trial_used')
     else:
         days = 7 if user['referrer_id'] else 3
         expires_at = datetime.now() + timedelta(days=days)
-        config_url = f"vless://trial-{user_id}@demo.server:443"
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute(
-            'UPDATE users SET subscription_end = ?, is_trial_used = 1 WHERE user_id = ?',
-            (expires_at, user_id)
-        )
-        conn.commit()
-        conn.close()
-        message = t(user_id, 'trial_activated',
-                    days=days,
-                    expires=expires_at.strftime('%Y-%m-%d %H:%M'),
-                    config=config_url)
-        keyboard = [
-            [InlineKeyboardButton(t(user_id, 'btn_buy'),  callback_data="plans")],
-            [InlineKeyboardButton(t(user_id, 'btn_back'), callback_data="back_main")],
-        ]
-    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
-
-async def show_plans(query):
-    user_id = query.from_user.id
-    message = t(user_id, 'plans_title')
-    keyboard = []
-    for i, plan in enumerate(PLANS['plans']):
-        plural = 's' if plan['devices'] > 1 else ''
-        message += t(user_id, 'plan_item',
-                     name=plan['name'], devices=plan['devices'],
-                     plural=plural, price=plan['prices']['30'])
-        keyboard.append([InlineKeyboardButton(
-            f"📱 {plan['name']} ({plan['devices']} device{'s' if plan['devices']>1 else ''})",
-            callback_data=f"plan_{i}"
-        )])
-    message += t(user_id, 'plans_features')
-    keyboard.append([InlineKeyboardButton(t(user_id, 'btn_back'), callback_data="back_main")])
-    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
-
-async def show_durations(query, plan_index):
-    user_id = query.from_user.id
-    plan = PLANS['plans'][plan_index]
-    message = t(user_id, 'duration_title', plan_name=plan['name'], devices=plan['devices'])
-    keyboard = []
-    for duration in PLANS['durations']:
-        price = plan['prices'][str(duration)]
-        label = f"{duration} days" if duration < 365 else "1 year"
-        monthly = price / (duration / 30)
-        message += t(user_id, 'duration_item', label=label, price=price, monthly=f"{monthly:.2f}")
-        keyboard.append([InlineKeyboardButton(
-            f"⏱ {label} - ${price}",
-            callback_data=f"dur_{plan_index}_{duration}"
-        )])
-    keyboard.append([InlineKeyboardButton(t(user_id, 'btn_back'), callback_data="plans")])
-    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+        config_url = _VLESS_TRIAL(uid=user_id)
+        # The write fsyncs; keep it off the event loop. Cached reads stay sync.
+        await asyncio.to_thread(db.activate_trial, user_id, expires_at)
+        _STATUS_CACHE.pop(user_id, None)
+        message = t_lang(lang, 'trial_activated',
+                         days=days,
+                         expires=expires_at.strftime('%Y-%m-%d %H:%M'),
+                         config=config_url)
+    await query.edit_message_text(message, reply_markup=TRIAL_KEYBOARD_CACHE[lang], parse_mode='HTML')
+
+async def show_plans(query, lang):
+    message = _T[(lang, 'plans_title')] + PLANS_BODY_CACHE[lang] + _T[(lang, 'plans_features')]
+    await query.edit_message_text(message, reply_markup=PLANS_KEYBOARD_CACHE[lang], parse_mode='HTML')
+
+async def show_durations(query, plan_index, lang):
+    plan = _PLAN_LIST[plan_index]
+    message = t_lang(lang, 'duration_title', plan_name=plan['name'], devices=plan['devices'])
+    message += DURATION_BODY_CACHE[(lang, plan_index)]
+    await query.edit_message_text(
+        message, reply_markup=DURATION_KEYBOARD_CACHE[(lang, plan_index)], parse_mode='HTML'
+    )
 
-async def show_payment_methods(query, plan_index, duration):
-    user_id = query.from_user.id
-    plan = PLANS['plans'][plan_index]
-    price = plan['prices'][str(duration)]
-    message = t(user_id, 'payment_title',
-                plan=f"{plan['name']} ({plan['devices']} devices)",
-                duration=duration, price=price)
-    keyboard = [
-        [InlineKeyboardButton("⭐ Telegram Stars",      callback_data=f"pay_stars_{plan_index}_{duration}")],
-        [InlineKeyboardButton("💳 Credit Card (Demo)",  callback_data=f"pay_card_{plan_index}_{duration}")],
-        [InlineKeyboardButton("🪙 Crypto (Demo)",       callback_data=f"pay_crypto_{plan_index}_{duration}")],
-        [InlineKeyboardButton(t(user_id, 'btn_back'),   callback_data=f"plan_{plan_index}")],
-    ]
-    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+async def show_payment_methods(query, plan_index, duration, lang):
+    message, markup = PAYMENT_SCREENS[(lang, plan_index, duration)]
+    await query.edit_message_text(message, reply_markup=markup, parse_mode='HTML')
 
-async def process_payment(query, user_id, method, plan_index, duration):
-    plan = PLANS['plans'][plan_index]
-    price = plan['prices'][str(duration)]
+async def process_payment(query, user_id, method, plan_index, duration, lang):
+    plan = _PLAN_LIST[plan_index]
+    price = plan['prices'][duration]
 
     if method == "stars":
         title = f"{plan['name']} Plan - {duration} days"
@@ -538,95 +882,65 @@ async def process_payment(query, user_id, method, plan_index, duration):
         return
 
     # Demo payment
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    current_time = datetime.now()
-    cursor.execute('SELECT subscription_end FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    current_end = result[0] if result and result[0] else current_time
-    if isinstance(current_end, str):
-        current_end = datetime.fromisoformat(current_end)
-    if current_end < current_time:
-        current_end = current_time
-    new_end = current_end + timedelta(days=duration)
-    cursor.execute(
-        'UPDATE users SET subscription_end = ?, total_paid = total_paid + ? WHERE user_id = ?',
-        (new_end, price, user_id)
+    config_url = _VLESS_SUB(uid=user_id)
+    new_end = await asyncio.to_thread(
+        db.record_payment, user_id, plan['name'], plan['devices'], duration, price, method, config_url
     )
-    config_url = f"vless://sub-{user_id}@demo.server:443"
-    cursor.execute('''
-        INSERT INTO subscriptions
-        (user_id, plan_name, devices, duration_days, price, payment_method, started_at, expires_at, config_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, plan['name'], plan['devices'], duration, price, method, current_time, new_end, config_url))
-    conn.commit()
-    conn.close()
-
-    message = t(user_id, 'payment_success',
-                plan=plan['name'], duration=duration, price=price,
-                expires=new_end.strftime('%Y-%m-%d'), config=config_url)
-    keyboard = [
-        [InlineKeyboardButton(t(user_id, 'btn_account'),  callback_data="account")],
-        [InlineKeyboardButton(t(user_id, 'btn_buy'),      callback_data="plans")],
-        [InlineKeyboardButton(t(user_id, 'btn_referral'), callback_data="referrals")],
-    ]
-    await query.edit_message_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    _STATUS_CACHE.pop(user_id, None)
+
+    message = t_lang(lang, 'payment_success',
+                     plan=plan['name'], duration=duration, price=price,
+                     expires=new_end.strftime('%Y-%m-%d'), config=config_url)
+    await query.edit_message_text(message, reply_markup=POST_PAY_KEYBOARD_CACHE[lang], parse_mode='HTML')
+
+# Keep strong references to fire-and-forget tasks so they aren't GC'd mid-flight.
+_background_tasks = set()
 
 async def precheckout_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.pre_checkout_query.answer(ok=True)
+    # Answer in the background so the webhook response isn't held open for
+    # the Bot API round trip.
+    task = asyncio.create_task(update.pre_checkout_query.answer(ok=True))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
 async def successful_payment_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     payment_info = update.message.successful_payment
     payload = payment_info.invoice_payload
-    parts = payload.split("_")
-    plan_index, duration = int(parts[1]), int(parts[3])
-    plan = PLANS['plans'][plan_index]
-    price = plan['prices'][str(duration)]
-
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    current_time = datetime.now()
-    cursor.execute('SELECT subscription_end FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    current_end = result[0] if result and result[0] else current_time
-    if isinstance(current_end, str):
-        current_end = datetime.fromisoformat(current_end)
-    if current_end < current_time:
-        current_end = current_time
-    new_end = current_end + timedelta(days=duration)
-    cursor.execute(
-        'UPDATE users SET subscription_end = ?, total_paid = total_paid + ? WHERE user_id = ?',
-        (new_end, price, user_id)
-    )
-    config_url = f"vless://paid-{user_id}@demo.server:443"
-    cursor.execute('''
-        INSERT INTO subscriptions
-        (user_id, plan_name, devices, duration_days, price, payment_method, started_at, expires_at, config_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, plan['name'], plan['devices'], duration, price, 'telegram_stars', current_time, new_end, config_url))
-    cursor.execute('''
-        INSERT INTO payments (user_id, amount, currency, payment_method, payment_id, status)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (user_id, price, payment_info.currency, 'telegram_stars',
-          payment_info.telegram_payment_charge_id, 'completed'))
-    conn.commit()
-    conn.close()
-
-    message = t(user_id, 'payment_success',
-                plan=plan['name'], duration=duration, price=price,
-                expires=new_end.strftime('%Y-%m-%d'), config=config_url)
-    keyboard = [
-        [InlineKeyboardButton(t(user_id, 'btn_account'), callback_data="account")],
-        [InlineKeyboardButton(t(user_id, 'btn_buy'),     callback_data="plans")],
-    ]
-    await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
-
-async def back_to_main(query):
+    match = _PAYLOAD_RE.match(payload)
+    if not match:
+        logger.error(f"Unrecognized invoice payload: {payload!r}")
+        return
+    plan_index, duration = int(match.group(1)), int(match.group(2))
+    plan = _PLAN_LIST[plan_index]
+    price = plan['prices'][duration]
+
+    config_url = _VLESS_PAID(uid=user_id)
+    # Overlap the fsync-bound DB write with the Telegram round trip: kick off
+    # the write, ack the user right away, then edit in the final receipt once
+    # the new expiry is known. Latency becomes max(fsync, RTT), not the sum.
+    db_task = asyncio.create_task(asyncio.to_thread(
+        db.record_star_payment,
+        user_id, plan['name'], plan['devices'], duration, price,
+        payment_info.currency, payment_info.telegram_payment_charge_id, config_url
+    ))
+    lang = db.get_language(user_id)
+    if lang not in TRANSLATIONS:
+        lang = 'en'
+    ack = await update.message.reply_text(t_lang(lang, 'payment_processing'))
+    new_end = await db_task
+    _STATUS_CACHE.pop(user_id, None)
+
+    message = t_lang(lang, 'payment_success',
+                     plan=plan['name'], duration=duration, price=price,
+                     expires=new_end.strftime('%Y-%m-%d'), config=config_url)
+    await ack.edit_text(message, reply_markup=POST_STAR_KEYBOARD_CACHE[lang], parse_mode='HTML')
+
+async def back_to_main(query, lang):
     user_id = query.from_user.id
-    status = get_subscription_status(user_id)
-    message = t(user_id, 'welcome_back', name=query.from_user.first_name, status=status)
-    await query.edit_message_text(message, reply_markup=get_main_menu(user_id), parse_mode='HTML')
+    status = get_subscription_status(user_id, lang)
+    message = t_lang(lang, 'welcome_back', name=query.from_user.first_name, status=status)
+    await query.edit_message_text(message, reply_markup=get_main_menu(user_id, lang), parse_mode='HTML')
 
 # ── Entry point ────────────────────────────────────────────────────────────────
 def main():
@@ -634,11 +948,35 @@ def main():
     logger.info("🌍 MULTILINGUAL VPN SHOP BOT — Railway Edition")
     logger.info("=" * 60)
 
-    app = Application.builder().token(BOT_TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CallbackQueryHandler(button_handler))
+    # uvloop (when installed) replaces the stock event loop for both webhook
+    # and polling modes — less per-update loop overhead, nothing else changes.
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("⚡ uvloop event loop enabled")
+    except ImportError:
+        pass
+
+    # HTTP/2 + a generous keepalive pool so outbound Bot API calls
+    # (edit_message_text, send_invoice) reuse one TLS session instead of
+    # paying a handshake per call; _REQUEST_CLS adds orjson decoding when
+    # available.
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(_REQUEST_CLS(
+            connection_pool_size=256, pool_timeout=5.0, http_version="2",
+            connect_timeout=10.0, read_timeout=20.0, write_timeout=20.0,
+        ))
+        .get_updates_request(_REQUEST_CLS(http_version="2"))
+        .build()
+    )
+    # block=False lets PTB run each update as its own task, so a burst of
+    # callbacks doesn't serialize behind one slow handler.
+    app.add_handler(CommandHandler("start", start, block=False))
+    app.add_handler(CallbackQueryHandler(button_handler, block=False))
     app.add_handler(PreCheckoutQueryHandler(precheckout_callback))
-    app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
+    app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback, block=False))
 
     # ── Webhook mode (Railway) vs Polling mode (local) ─────────────────────────
     if WEBHOOK_URL: